@@ -23,7 +23,8 @@ setup(
     author="Anders Huss",
     author_email="andhus@kth.se",
     license='MIT',
-    install_requires=['scantree>=0.0.1'],
+    install_requires=['scantree>=0.0.1', 'pathspec'],
+    extras_require={'blake3': ['blake3']},
     packages=find_packages('src'),
     package_dir={'': 'src'},
     include_package_data=True,
@@ -4,22 +4,46 @@
 from __future__ import print_function, division
 
 import os
+import re
+import sys
+import heapq
+import socket
 import hashlib
-import pkg_resources
+import binascii
+import warnings
 
+from collections import OrderedDict
+from contextlib import closing
 from functools import partial
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
+from pathspec.util import normalize_file
+from pathspec.patterns import GitWildMatchPattern
 from scantree import (
     scantree,
     RecursionFilter,
     CyclicLinkedDir,
 )
 
+try:
+    from importlib.metadata import version as _get_version
+except ImportError:  # python < 3.8
+    import pkg_resources
+
+    def _get_version(distribution_name):
+        return pkg_resources.require(distribution_name)[0].version
+
+try:
+    import blake3
+except ImportError:  # optional dependency
+    blake3 = None
+
 __all__ = [
     '__version__',
     'algorithms_guaranteed',
     'algorithms_available',
+    'cpu_features',
     'dirhash',
     'dirhash_impl',
     'included_paths',
@@ -28,10 +52,59 @@ __all__ = [
     'Protocol'
 ]
 
-__version__ = pkg_resources.require("dirhash")[0].version
+__version__ = _get_version('dirhash')
 
 algorithms_guaranteed = {'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512'}
-algorithms_available = hashlib.algorithms_available
+algorithms_available = set(hashlib.algorithms_available)
+if blake3 is not None:
+    algorithms_available.add('blake3')
+
+
+def _detect_sha_ni():
+    """Returns whether the CPU supports the Intel SHA extensions (SHA-NI) used by
+    OpenSSL to accelerate sha1, sha224 and sha256, or `None` if this could not be
+    determined (detection is only supported on Linux).
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return 'sha_ni' in line.partition(':')[2].split()
+    except EnvironmentError:
+        pass
+
+    return None
+
+
+cpu_features = {'sha-ni-available': _detect_sha_ni()}
+
+_sha_ni_algorithms = {'sha1', 'sha224', 'sha256'}
+_sha_ni_warning_issued = False
+
+# files of at least this size are hashed through `AF_ALG` sockets (see below)
+_AF_ALG_THRESHOLD = 2**20
+
+# pages of files of at least this size are dropped from the page cache after hashing
+_FADV_DONTNEED_THRESHOLD = 2**26
+
+# hashers for which (large) files are hashed in the Linux kernel, through the
+# `AF_ALG` socket interface, as (hasher factory, kernel algorithm name, digest size)
+_af_alg_algorithms = (
+    (hashlib.md5, 'md5', 16),
+    (hashlib.sha1, 'sha1', 20),
+    (hashlib.sha256, 'sha256', 32),
+    (hashlib.sha512, 'sha512', 64),
+)
+# the max number of bytes transferred by one `sendfile` call on Linux
+_af_alg_max_size = 0x7ffff000
+# set to False on first failure to create an `AF_ALG` socket
+_af_alg_usable = (
+    sys.platform.startswith('linux') and
+    hasattr(socket, 'AF_ALG') and
+    hasattr(os, 'sendfile')
+)
 
 
 def dirhash(
@@ -45,14 +118,16 @@ def dirhash(
     entry_properties=('name', 'data'),
     allow_cyclic_links=False,
     chunk_size=2**20,
-    jobs=1
+    jobs=1,
+    jobs_backend='thread'
 ):
     """Computes the hash of a directory based on its structure and content.
 
     # Arguments
         directory: Union[str, pathlib.Path] - Path to the directory to hash.
         algorithm: str - The name of the hashing algorithm to use. See
-            `dirhash.algorithms_available` for the available options.
+            `dirhash.algorithms_available` for the available options, which
+            includes "blake3" if the optional `blake3` package is installed.
         match: Iterable[str] - An iterable of glob/wildcard match-patterns for paths
             to include when computing the hash. Default is ["*"] which means that all
             files and directories are matched.  To e.g. only include python source
@@ -86,11 +161,19 @@ def dirhash(
         chunk_size: int - The number of bytes to read in one go from files while
             being hashed. A too small size will slow down the processing and a larger
             size consumes more working memory. Default 2**20 byte = 1 MiB.
-        jobs: int - The number of processes to use when computing the hash.
-            Default `1`, which means that a single (the main) process is used. NOTE
-            that using multiprocessing can significantly speed-up execution, see
+        jobs: int - The number of worker threads (or processes, see `jobs_backend`)
+            to use when computing the hash. Default `1`, which means that a single
+            (the main) thread is used. NOTE that hashing files in parallel can
+            significantly speed-up execution, see
             `https://github.com/andhus/dirhash-python/benchmark` for further
             details.
+        jobs_backend: str - One of "thread" (default) and "process". Determines
+            whether files are hashed in parallel by a pool of threads or of
+            processes when `jobs > 1`. Threads suffice for the `hashlib` algorithms
+            since these release the GIL while hashing data (of at least 2048
+            bytes) and avoid the overhead of starting processes and transferring
+            data between them. Use "process" for custom hashing algorithms
+            implemented in pure python.
 
     # Returns
         str - The hash/checksum as a string of the hexadecimal digits (the result of
@@ -162,7 +245,8 @@ def dirhash(
         filter_=filter_,
         protocol=protocol,
         chunk_size=chunk_size,
-        jobs=jobs
+        jobs=jobs,
+        jobs_backend=jobs_backend
     )
 
 
@@ -172,7 +256,8 @@ def dirhash_impl(
     filter_=None,
     protocol=None,
     chunk_size=2**20,
-    jobs=1
+    jobs=1,
+    jobs_backend='thread'
 ):
     """Computes the hash of a directory based on its structure and content.
 
@@ -182,7 +267,8 @@ def dirhash_impl(
     # Arguments
         directory: Union[str, pathlib.Path] - Path to the directory to hash.
         algorithm: str - The name of the hashing algorithm to use. See
-            `dirhash.algorithms_available` for the available options.
+            `dirhash.algorithms_available` for the available options, which
+            includes "blake3" if the optional `blake3` package is installed.
             It is also possible to provide a callable object that returns an instance
             implementing the `hashlib._hashlib.HASH` interface.
         filter_: dirhash.Filter - Determines what files and directories to include
@@ -193,11 +279,19 @@ def dirhash_impl(
         chunk_size: int - The number of bytes to read in one go from files while
             being hashed. A too small size will slow down the processing and a larger
             size consumes more working memory. Default 2**20 byte = 1 MiB.
-        jobs: int - The number of processes to use when computing the hash.
-            Default `1`, which means that a single (the main) process is used. NOTE
-            that using multiprocessing can significantly speed-up execution, see
+        jobs: int - The number of worker threads (or processes, see `jobs_backend`)
+            to use when computing the hash. Default `1`, which means that a single
+            (the main) thread is used. NOTE that hashing files in parallel can
+            significantly speed-up execution, see
             `https://github.com/andhus/dirhash/tree/master/benchmark` for further
             details.
+        jobs_backend: str - One of "thread" (default) and "process". Determines
+            whether files are hashed in parallel by a pool of threads or of
+            processes when `jobs > 1`. Threads suffice for the `hashlib` algorithms
+            since these release the GIL while hashing data (of at least 2048
+            bytes) and avoid the overhead of starting processes and transferring
+            data between them. Use "process" for custom hashing algorithms
+            implemented in pure python.
 
     # Returns
         str - The hash/checksum as a string of the hexadecimal digits (the result of
@@ -224,6 +318,22 @@ def dirhash_impl(
     filter_ = get_instance(filter_, Filter, 'filter_')
     protocol = get_instance(protocol, Protocol, 'protocol')
     hasher_factory = _get_hasher_factory(algorithm)
+    if jobs_backend not in _pool_types:
+        raise ValueError(
+            '`jobs_backend` must be one of: {}'.format(sorted(_pool_types)))
+    if jobs < 1:
+        raise ValueError('`jobs` must be at least 1')
+
+    # copying an initial hasher is cheaper than creating a new one for each directory
+    initial_hasher = hasher_factory()
+    if hasattr(initial_hasher, 'copy'):
+        def get_descriptor_hash(descriptor):
+            hasher = initial_hasher.copy()
+            hasher.update(descriptor)
+            return hasher.hexdigest()
+    else:
+        def get_descriptor_hash(descriptor):
+            return hasher_factory(descriptor).hexdigest()
 
     def dir_apply(dir_node):
         if not filter_.empty_dirs:
@@ -232,20 +342,26 @@ def dirhash_impl(
                 # before `dir_apply` with `filter_.empty_dirs=False`)
                 raise ValueError('{}: Nothing to hash'.format(directory))
         descriptor = protocol.get_descriptor(dir_node)
-        _dirhash = hasher_factory(descriptor.encode('utf-8')).hexdigest()
+        _dirhash = get_descriptor_hash(descriptor)
 
         return dir_node.path, _dirhash
 
-    if jobs == 1:
-        cache = {}
-
-        def file_apply(path):
-            return path, _get_filehash(
-                path.real,
-                hasher_factory,
-                chunk_size=chunk_size,
-                cache=cache
-            )
+    # files are not read if their hashes are not included in the descriptors
+    hash_files = protocol.EntryProperties.DATA in protocol.entry_properties
+    if jobs == 1 or not hash_files:
+        if hash_files:
+            cache = {}
+
+            def file_apply(path):
+                return path, _get_filehash(
+                    path.real,
+                    hasher_factory,
+                    chunk_size=chunk_size,
+                    cache=cache
+                )
+        else:
+            def file_apply(path):
+                return path, None
 
         _, dirhash_ = scantree(
             directory,
@@ -258,11 +374,22 @@ def dirhash_impl(
             include_empty=filter_.empty_dirs,
             jobs=1
         )
-    else:  # multiprocessing
-        real_paths = set()
+    else:  # parallel hashing of files
+        # Files are identified by device and inode number, such that hard links to
+        # the same file are only hashed once, and by real path if the inode number
+        # is not provided by the file system.
+        real_path_to_id = {}
+        id_to_real_path = {}
+        id_to_size = {}
 
         def extract_real_paths(path):
-            real_paths.add(path.real)
+            if path.real not in real_path_to_id:
+                stat = os.stat(path.real)
+                file_id = (stat.st_dev, stat.st_ino) if stat.st_ino else path.real
+                real_path_to_id[path.real] = file_id
+                if file_id not in id_to_real_path:
+                    id_to_real_path[file_id] = path.real
+                    id_to_size[path.real] = stat.st_size
             return path
 
         root_node = scantree(
@@ -275,22 +402,40 @@ def dirhash_impl(
             include_empty=filter_.empty_dirs,
             jobs=1
         )
-        real_paths = list(real_paths)
-        # hash files in parallel
-        file_hashes = _parmap(
-            partial(
-                _get_filehash,
-                hasher_factory=hasher_factory,
-                chunk_size=chunk_size
-            ),
-            real_paths,
-            jobs=jobs
-        )
+        # hash files in parallel, one task per bin of files with similar total size
+        bins = _partition_by_size(id_to_size, num_bins=jobs)
+        if jobs_backend == 'process':
+            # set up the hasher factory once per process instead of pickling it
+            # with each task
+            bin_hashes = _parmap(
+                _worker_get_filehashes,
+                bins,
+                jobs=jobs,
+                chunksize=1,
+                backend=jobs_backend,
+                initializer=_init_worker,
+                initargs=(algorithm, chunk_size)
+            )
+        else:
+            bin_hashes = _parmap(
+                partial(
+                    _get_filehashes,
+                    hasher_factory=hasher_factory,
+                    chunk_size=chunk_size
+                ),
+                bins,
+                jobs=jobs,
+                chunksize=1,
+                backend=jobs_backend
+            )
         # prepare the mapping with precomputed file hashes
-        real_path_to_hash = dict(zip(real_paths, file_hashes))
+        id_to_hash = {}
+        for bin_, file_hashes in zip(bins, bin_hashes):
+            for real_path, file_hash in zip(bin_, file_hashes):
+                id_to_hash[real_path_to_id[real_path]] = file_hash
 
         def file_apply(path):
-            return path, real_path_to_hash[path.real]
+            return path, id_to_hash[real_path_to_id[path.real]]
 
         _, dirhash_ = root_node.apply(file_apply=file_apply, dir_apply=dir_apply)
 
@@ -376,6 +521,57 @@ class Filter(RecursionFilter):
             match=match_patterns
         )
         self.empty_dirs = empty_dirs
+        if self.match_patterns == ('*',):
+            self._match_regex, self._match_includes = None, None
+        else:
+            self._match_regex, self._match_includes = _compile_match_patterns(
+                self.match_patterns)
+
+    def match_file(self, filepath):
+        """Match file against match patterns.
+
+        Equivalent to `scantree.RecursionFilter.match_file` but all patterns are
+        matched at once by a single regular expression.
+        """
+        if self._match_regex is None:
+            if self._match_includes is None:
+                return True
+            return super(Filter, self).match_file(filepath)
+        match = self._match_regex.match(normalize_file(filepath))
+        if match is None:
+            return False
+        return self._match_includes[match.lastindex - 1]
+
+
+def _compile_match_patterns(match_patterns):
+    """Compiles the gitignore-style match patterns into a single regular expression.
+
+    The regular expressions of the patterns are combined as alternatives in reversed
+    order, each in a capturing group. The first alternative that matches a path is
+    then the last matching pattern, which determines whether the path is included,
+    and its index is given by the `lastindex` of the match.
+
+    # Returns
+        Tuple[Optional[re.Pattern], List[bool]] - The combined regular expression and
+        whether each alternative includes (or excludes) the path. The expression is
+        `None` if the patterns could not be combined.
+    """
+    alternatives = []
+    includes = []
+    for pattern in reversed([GitWildMatchPattern(p) for p in match_patterns]):
+        if pattern.include is None:  # e.g. blank line or comment
+            continue
+        # make named groups non-capturing, so that `lastindex` refers to the
+        # alternative and group names are not duplicated
+        alternatives.append(
+            '(' + re.sub(r'\(\?P<\w+>', '(?:', pattern.regex.pattern) + ')')
+        includes.append(pattern.include)
+    if not alternatives:
+        return re.compile('(?!)'), []  # never matches
+    try:
+        return re.compile('|'.join(alternatives)), includes
+    except re.error:
+        return None, includes
 
 
 def get_match_patterns(
@@ -414,17 +610,8 @@ def get_match_patterns(
 
     match_spec = match + ['!' + ign for ign in ignore]
 
-    def deduplicate(items):
-        items_set = set([])
-        dd_items = []
-        for item in items:
-            if item not in items_set:
-                dd_items.append(item)
-                items_set.add(item)
-
-        return dd_items
-
-    return deduplicate(match_spec)
+    # deduplicate, preserving order
+    return list(OrderedDict.fromkeys(match_spec))
 
 
 class Protocol(object):
@@ -466,34 +653,35 @@ class Protocol(object):
         NAME = 'name'
         DATA = 'data'
         IS_LINK = 'is_link'
-        options = {NAME, DATA, IS_LINK}
+        options = frozenset([NAME, DATA, IS_LINK])
         _DIRHASH = 'dirhash'
 
-    _entry_property_separator = '\000'
-    _entry_descriptor_separator = '\000\000'
+    _entry_property_separator = b'\000'
+    _entry_descriptor_separator = b'\000\000'
+
+    # the "<name>:" prefixes of the entry property strings
+    _dirhash_key = b'dirhash:'
+    _data_key = b'data:'
+    _is_link_key = b'is_link:'
+    _name_key = b'name:'
 
     def __init__(
         self,
         entry_properties=('name', 'data'),
         allow_cyclic_links=False
     ):
-        entry_properties = set(entry_properties)
-        if not entry_properties.issubset(self.EntryProperties.options):
-            raise ValueError(
-                'entry properties {} not supported'.format(
-                    entry_properties - self.EntryProperties.options)
-            )
-        if not (
-            self.EntryProperties.NAME in entry_properties or
-            self.EntryProperties.DATA in entry_properties
-        ):
+        entry_properties = frozenset(entry_properties)
+        invalid = entry_properties - self.EntryProperties.options
+        if invalid:
+            raise ValueError('entry properties {} not supported'.format(invalid))
+        self._include_name = self.EntryProperties.NAME in entry_properties
+        self._include_data = self.EntryProperties.DATA in entry_properties
+        if not (self._include_name or self._include_data):
             raise ValueError(
                 'at least one of entry properties `name` and `data` must be used'
             )
-        self.entry_properties = entry_properties
-        self._include_name = self.EntryProperties.NAME in entry_properties
-        self._include_data = self.EntryProperties.DATA in entry_properties
         self._include_is_link = self.EntryProperties.IS_LINK in entry_properties
+        self.entry_properties = entry_properties
 
         if not isinstance(allow_cyclic_links, bool):
             raise ValueError(
@@ -506,33 +694,43 @@ class Protocol(object):
         if isinstance(dir_node, CyclicLinkedDir):
             return self._get_cyclic_linked_dir_descriptor(dir_node)
 
+        # NOTE: descriptors are assembled serially also for wide directories; a
+        # `heapq.merge` of sorted sublists is slower than a single sort and sending
+        # entries to pool workers costs more than encoding them.
         entries = dir_node.directories + dir_node.files
         entry_descriptors = [
             self._get_entry_descriptor(
                 self._get_entry_properties(path, entry_hash)
             ) for path, entry_hash in entries
         ]
-        return self._entry_descriptor_separator.join(sorted(entry_descriptors))
+        # NOTE: the entries can not be sorted by name up front, the descriptors
+        # start with the data/dirhash value (if included) which determines the order
+        entry_descriptors.sort()
+        return self._entry_descriptor_separator.join(entry_descriptors)
 
     @classmethod
     def _get_entry_descriptor(cls, entry_properties):
-        entry_strings = [
-            '{}:{}'.format(name, value)
-            for name, value in entry_properties
-        ]
-        return cls._entry_property_separator.join(sorted(entry_strings))
+        # NOTE: `entry_properties` are ordered such that the entry strings are sorted
+        return cls._entry_property_separator.join([
+            key + value for key, value in entry_properties
+        ])
 
     def _get_entry_properties(self, path, entry_hash):
+        """Returns the properties of the entry as `(b"<name>:", b"<value>")` pairs
+        (utf-8 encoded)."""
+        # NOTE: the order of properties must match the sorting of "<name>:<value>"
+        # which, for the fixed set of property names, is the order of names.
         properties = []
         if path.is_dir():
-            properties.append((self.EntryProperties._DIRHASH, entry_hash))
+            properties.append((self._dirhash_key, entry_hash.encode('utf-8')))
         elif self._include_data:  # path is file
-            properties.append((self.EntryProperties.DATA, entry_hash))
+            properties.append((self._data_key, _encode_filehash(entry_hash)))
 
-        if self._include_name:
-            properties.append((self.EntryProperties.NAME, path.name))
         if self._include_is_link:
-            properties.append((self.EntryProperties.IS_LINK, path.is_symlink))
+            properties.append(
+                (self._is_link_key, str(path.is_symlink).encode('utf-8')))
+        if self._include_name:
+            properties.append((self._name_key, path.name.encode('utf-8')))
 
         return properties
 
@@ -546,46 +744,225 @@ class Protocol(object):
             os.path.join('.', relpath)
         )
         # TODO normalize posix!
-        return path_to_target
+        return path_to_target.encode('utf-8')
 
 
 def _get_hasher_factory(algorithm):
     """Returns a "factory" of hasher instances corresponding to the given algorithm
     name. Bypasses input argument `algorithm` if it is already a hasher factory
     (verified by attempting calls to required methods).
+
+    The factory for each algorithm name is cached and a verified hasher factory is
+    marked by the attribute `_dirhash_verified` (if attributes can be set on it), so
+    repeated calls are cheap.
     """
+    if callable(algorithm):
+        return _verify_hasher_factory(algorithm)
+
+    hasher_factory = _hasher_factories.get(algorithm)
+    if hasher_factory is None:
+        hasher_factory = _get_named_hasher_factory(algorithm)
+        _hasher_factories[algorithm] = hasher_factory
+
+    return hasher_factory
+
+
+# cache of hasher factories by algorithm name, see `_get_hasher_factory`
+_hasher_factories = {}
+
+
+def _get_named_hasher_factory(algorithm):
     if algorithm in algorithms_guaranteed:
+        if algorithm in _sha_ni_algorithms:
+            _warn_if_sha_ni_missing(algorithm)
         return getattr(hashlib, algorithm)
 
+    if algorithm == 'blake3' and blake3 is not None:
+        return _blake3
+
     if algorithm in algorithms_available:
         return partial(hashlib.new, algorithm)
 
-    try:  # bypass algorithm if already a hasher factory
-        hasher = algorithm(b'')
+    raise ValueError(
+        '`algorithm` must be one of: {}`'.format(algorithms_available))
+
+
+def _verify_hasher_factory(hasher_factory):
+    # NOTE: only look in the `__dict__` of the object itself, a subclass of a
+    # verified class must be verified separately
+    if getattr(hasher_factory, '__dict__', {}).get('_dirhash_verified', False):
+        return hasher_factory
+
+    try:
+        hasher = hasher_factory(b'')
         hasher.update(b'')
         hasher.hexdigest()
-        return algorithm
     except:
+        raise ValueError(
+            '`algorithm` must be one of: {}`'.format(algorithms_available))
+
+    try:
+        hasher_factory._dirhash_verified = True
+    except (AttributeError, TypeError):  # e.g. built-in function
         pass
 
-    raise ValueError(
-        '`algorithm` must be one of: {}`'.format(algorithms_available))
+    return hasher_factory
+
+
+def _warn_if_sha_ni_missing(algorithm):
+    """Warns (once) if the CPU is known to lack the SHA extensions, in which case
+    `blake2b` is typically faster than the given `algorithm`."""
+    global _sha_ni_warning_issued
+    if _sha_ni_warning_issued or cpu_features['sha-ni-available'] is not False:
+        return
+    _sha_ni_warning_issued = True
+    warnings.warn(
+        'The CPU does not support the SHA extensions (SHA-NI), hashing with {} is '
+        'not hardware accelerated. Consider using "blake2b" which is faster on '
+        'this hardware.'.format(algorithm),
+        stacklevel=_get_caller_stacklevel()
+    )
+
 
+def _get_caller_stacklevel():
+    """Returns the `stacklevel` for `warnings.warn`, called by the function calling
+    this one, that points at the first caller outside of this module (e.g. the call
+    to `dirhash`)."""
+    frame = sys._getframe(1)
+    stacklevel = 1
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+        stacklevel += 1
+    return stacklevel
 
-def _parmap(func, iterable, jobs=1):
-    """Map with multiprocessing.Pool"""
+
+_import_pid = os.getpid()
+
+
+def _blake3(data=b''):
+    """Returns a `blake3.blake3` hasher which uses multiple threads internally for
+    large inputs. Multithreading is disabled in processes forked from the one that
+    imported this module, since the thread pool of the parent is not usable there.
+    """
+    if os.getpid() == _import_pid:
+        max_threads = blake3.blake3.AUTO
+    else:
+        max_threads = 1
+    return blake3.blake3(data, max_threads=max_threads)
+
+
+_pool_types = {'thread': ThreadPool, 'process': Pool}
+
+
+def _parmap(
+    func,
+    iterable,
+    jobs=1,
+    chunksize=None,
+    backend='thread',
+    initializer=None,
+    initargs=()
+):
+    """Map with multiprocessing.pool.ThreadPool or multiprocessing.Pool
+
+    Results are collected as they finish (with `imap_unordered`) and returned in
+    the order of `iterable`. `chunksize` is the number of elements sent to a worker
+    at a time, by default a quarter of the elements per worker. `backend` is one of
+    "thread" and "process". `initializer(*initargs)` is called once by each worker
+    when it starts.
+    """
     if jobs == 1:
         return [func(element) for element in iterable]
 
-    pool = Pool(jobs)
+    elements = list(iterable)
+    if chunksize is None:
+        chunksize = max(1, len(elements) // (jobs * 4))
+
+    pool = _pool_types[backend](jobs, initializer=initializer, initargs=initargs)
     try:
-        results = pool.map(func, iterable)
-    finally:
+        indexed_results = list(pool.imap_unordered(
+            partial(_apply_indexed, func),
+            enumerate(elements),
+            chunksize=chunksize
+        ))
+    except BaseException:
+        # don't leave workers running on e.g. KeyboardInterrupt
+        pool.terminate()
+        raise
+    else:
         pool.close()
+    finally:
+        pool.join()
+
+    results = [None] * len(elements)
+    for index, result in indexed_results:
+        results[index] = result
 
     return results
 
 
+def _apply_indexed(func, indexed_element):
+    index, element = indexed_element
+    return index, func(element)
+
+
+# approximate cost of opening a file, in terms of number of bytes read
+_FILE_OPEN_COST = 2**12
+
+
+def _partition_by_size(sizes, num_bins):
+    """Partitions filepaths into (at most) `num_bins` bins of roughly the same total
+    file size, using the longest-processing-time-first (LPT) heuristic: files are
+    assigned in order of decreasing size to the bin with the least total size.
+
+    # Arguments
+        sizes: Dict[str, int] - Mapping from filepath to file size in bytes.
+        num_bins: int - The (max) number of bins.
+
+    # Returns
+        List[List[str]] - The non-empty bins.
+    """
+    sizes_and_paths = sorted(
+        ((size + _FILE_OPEN_COST, filepath) for filepath, size in sizes.items()),
+        reverse=True
+    )
+    bins = [[] for _ in range(num_bins)]
+    bin_heap = [(0, bin_index) for bin_index in range(num_bins)]
+    for size, filepath in sizes_and_paths:
+        total_size, bin_index = heapq.heappop(bin_heap)
+        bins[bin_index].append(filepath)
+        heapq.heappush(bin_heap, (total_size + size, bin_index))
+
+    return [bin_ for bin_ in bins if bin_]
+
+
+# per process state of pool workers, set by `_init_worker`
+_worker_state = {}
+
+
+def _init_worker(algorithm, chunk_size):
+    _worker_state['hasher_factory'] = _get_hasher_factory(algorithm)
+    _worker_state['chunk_size'] = chunk_size
+
+
+def _worker_get_filehashes(filepaths):
+    """Compute the hashes of the given filepaths with the hasher factory and chunk
+    size set up by `_init_worker`."""
+    return _get_filehashes(
+        filepaths,
+        hasher_factory=_worker_state['hasher_factory'],
+        chunk_size=_worker_state['chunk_size']
+    )
+
+
+def _get_filehashes(filepaths, hasher_factory, chunk_size):
+    """Compute the hashes of the given filepaths, see `_get_filehash`."""
+    return [
+        _get_filehash(filepath, hasher_factory, chunk_size)
+        for filepath in filepaths
+    ]
+
+
 def _get_filehash(filepath, hasher_factory, chunk_size, cache=None):
     """Compute the hash of the given filepath.
 
@@ -594,13 +971,15 @@ def _get_filehash(filepath, hasher_factory, chunk_size, cache=None):
         hasher_factory: (f: f() -> hashlib._hashlib.HASH): Callable that returns an
             instance of the `hashlib._hashlib.HASH` interface.
         chunk_size (int): The number of bytes to read in one go from files while
-            being hashed.
-        cache ({str: str} | None): A mapping from `filepath` to hash (return value
-            of this function). If not None, a lookup will be attempted before hashing
-            the file and the result will be added after completion.
+            being hashed. Files no larger than `chunk_size` are read at once.
+        cache ({str: bytes | str} | None): A mapping from `filepath` to hash (return
+            value of this function). If not None, a lookup will be attempted before
+            hashing the file and the result will be added after completion.
 
     # Returns
-        The hash/checksum as a string the of hexadecimal digits.
+        The hash/checksum as `bytes` (the `digest` of the hasher), or as a string of
+        hexadecimal digits if the hasher only implements `hexdigest`. Hex encoding
+        is deferred to `Protocol`, see `_encode_filehash`.
 
     # Side-effects
         The `cache` is updated if not None.
@@ -612,9 +991,119 @@ def _get_filehash(filepath, hasher_factory, chunk_size, cache=None):
             cache[filepath] = filehash
         return filehash
 
-    hasher = hasher_factory()
     with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(chunk_size), b''):
-            hasher.update(chunk)
+        size = os.fstat(f.fileno()).st_size
+        if size > chunk_size:
+            _fadvise(f, 'POSIX_FADV_SEQUENTIAL')
+        filehash = _hash_file(f, size, hasher_factory, chunk_size)
+        if size >= _FADV_DONTNEED_THRESHOLD:
+            # keep large files, that are unlikely to be read again soon, from
+            # evicting other data from the page cache
+            _fadvise(f, 'POSIX_FADV_DONTNEED')
+
+    return filehash
+
+
+def _hash_file(fileobj, size, hasher_factory, chunk_size):
+    """Compute the hash of the open file (of given size), see `_get_filehash`."""
+    if _AF_ALG_THRESHOLD <= size <= _af_alg_max_size and _af_alg_usable:
+        for factory, algorithm_name, digest_size in _af_alg_algorithms:
+            if factory is hasher_factory:
+                filehash = _get_filehash_af_alg(
+                    fileobj, size, algorithm_name, digest_size)
+                if filehash is not None:
+                    return filehash
+                break
+
+    hasher = hasher_factory()
+    if size <= chunk_size:
+        # NOTE: special files (e.g. in /proc) may report size zero but still
+        # have content, `read` without size argument reads until EOF.
+        hasher.update(fileobj.read())
+        return _get_digest(hasher)
+
+    # read into a reusable buffer to avoid allocating a new object per chunk
+    buffer_ = bytearray(chunk_size)
+    view = memoryview(buffer_)
+    for num_bytes in iter(lambda: fileobj.readinto(buffer_), 0):
+        hasher.update(view[:num_bytes])
+
+    return _get_digest(hasher)
+
+
+def _get_digest(hasher):
+    """Returns the digest of the hasher as `bytes`, or the hexdigest as text if the
+    hasher does not implement the `digest` method."""
+    if hasattr(hasher, 'digest'):
+        return hasher.digest()
+    hexdigest = hasher.hexdigest()
+    if isinstance(hexdigest, bytes):
+        hexdigest = hexdigest.decode('utf-8')
+    return hexdigest
+
+
+def _encode_filehash(filehash):
+    """Returns the utf-8 encoded hexdigest of a file hash as returned by
+    `_get_filehash`."""
+    if isinstance(filehash, bytes):
+        return binascii.hexlify(filehash)
+    return filehash.encode('utf-8')
+
+
+def _fadvise(fileobj, advice):
+    """Announce the intended access pattern of the whole file to the kernel, if
+    supported by the platform. `advice` is the name of one of the `os.POSIX_FADV_*`
+    constants."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fileobj.fileno(), 0, 0, getattr(os, advice))
+    except EnvironmentError:
+        pass
+
+
+def _get_filehash_af_alg(fileobj, size, algorithm_name, digest_size):
+    """Compute the hash of the given file in the Linux kernel using the `AF_ALG`
+    socket interface. The file is passed to the kernel with `sendfile`, without
+    copying its content to user space.
 
-    return hasher.hexdigest()
+    # Arguments
+        fileobj: file - The file to hash, opened in binary mode.
+        size: int - The size of the file in bytes. Must not exceed
+            `_af_alg_max_size`.
+        algorithm_name: str - The kernel name of the hashing algorithm.
+        digest_size: int - The size in bytes of the digest of the algorithm.
+
+    # Returns
+        The hash/checksum as `bytes`, or `None` if the file could not be hashed this
+        way.
+
+    # Side-effects
+        Sets `_af_alg_usable` to `False` if `AF_ALG` sockets are not supported.
+    """
+    global _af_alg_usable
+    try:
+        alg_socket = socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET)
+    except EnvironmentError:
+        _af_alg_usable = False
+        return None
+
+    with closing(alg_socket):
+        try:
+            alg_socket.bind(('hash', algorithm_name))
+            op_socket, _ = alg_socket.accept()
+        except EnvironmentError:
+            return None
+        with closing(op_socket):
+            # NOTE: the kernel finalizes the hash at the end of each `sendfile`
+            # call, so the whole file must be sent with a single call.
+            try:
+                num_bytes = os.sendfile(
+                    op_socket.fileno(), fileobj.fileno(), 0, size)
+            except EnvironmentError:
+                return None
+            if num_bytes != size:
+                return None
+            digest = op_socket.recv(digest_size)
+
+    return digest
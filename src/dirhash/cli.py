@@ -14,7 +14,13 @@ def main():
         kwargs = get_kwargs(sys.argv[1:])
         if kwargs.pop('list'):
             # kwargs below have no effect when listing
-            for k in ['algorithm', 'chunk_size', 'jobs', 'entry_properties']:
+            for k in [
+                'algorithm',
+                'chunk_size',
+                'jobs',
+                'jobs_backend',
+                'entry_properties'
+            ]:
                 kwargs.pop(k)
             for leafpath in dirhash.included_paths(**kwargs):
                 print(leafpath)
@@ -47,9 +53,13 @@ def get_kwargs(args):
             'Additionally available on current platform: {}. Note that the same '
             'algorithm may appear multiple times in this set under different names '
             '(thanks to OpenSSL) '
-            '[https://docs.python.org/2/library/hashlib.html]'.format(
+            '[https://docs.python.org/2/library/hashlib.html]. Hardware '
+            'acceleration of sha1, sha224 and sha256 (SHA-NI) available on current '
+            'CPU: {}.'.format(
                 sorted(dirhash.algorithms_guaranteed),
-                sorted(dirhash.algorithms_available - dirhash.algorithms_guaranteed)
+                sorted(dirhash.algorithms_available - dirhash.algorithms_guaranteed),
+                {True: 'yes', False: 'no', None: 'unknown'}[
+                    dirhash.cpu_features['sha-ni-available']]
             )
         ),
         metavar=''
@@ -161,7 +171,13 @@ def get_kwargs(args):
         '-j', '--jobs',
         type=int,
         default=1,  # TODO make default number of cores?
-        help='Number of jobs (parallel processes) to use.'
+        help='Number of jobs (parallel threads or processes) to use.'
+    )
+    implementation_options.add_argument(
+        '--jobs-backend',
+        choices=['thread', 'process'],
+        default='thread',
+        help='Whether to use parallel threads (default) or processes for jobs.'
     )
 
     special_options = parser.add_argument_group(title='Special options')
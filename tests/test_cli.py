@@ -127,6 +127,10 @@ class TestCLI(object):
                 '. -a md5 -j 10',
                 {'jobs': 10}
             ),
+            (
+                '. -a md5 -j 10 --jobs-backend process',
+                {'jobs': 10, 'jobs_backend': 'process'}
+            ),
             (
                 '. -a md5 -s 32000',
                 {'chunk_size': 32000}
@@ -147,7 +151,8 @@ class TestCLI(object):
             'entry_properties': ['data', 'name'],
             'allow_cyclic_links': False,
             'chunk_size': 2 ** 20,
-            'jobs': 1
+            'jobs': 1,
+            'jobs_backend': 'thread'
         }
         kwargs_expected.update(non_default_kwargs)
         kwargs = get_kwargs(shlex.split(argstring))
@@ -163,6 +168,7 @@ class TestCLI(object):
               '. -a sha256 --list',
               '. --properties name --list',
               '. --jobs 2 --list',
+              '. --jobs 2 --jobs-backend process --list',
               '. --chunk-size 2 --list'],
              ('.dir/file\n'
               '.file\n'
@@ -2,12 +2,15 @@ from __future__ import print_function, division
 
 import os
 import shutil
+import socket
 import hashlib
 import tempfile
+import warnings
 from time import sleep, time
 
 import pytest
 
+import dirhash as dirhash_module
 from dirhash import (
     _get_hasher_factory,
     get_match_patterns,
@@ -17,10 +20,14 @@ from dirhash import (
     algorithms_guaranteed,
     Protocol,
     _parmap,
+    _get_filehash,
+    _get_filehash_af_alg,
+    _partition_by_size,
+    _AF_ALG_THRESHOLD,
     Filter,
     dirhash_impl
 )
-from scantree import SymlinkRecursionError
+from scantree import SymlinkRecursionError, RecursionFilter
 
 
 class TestGetHasherFactory(object):
@@ -46,6 +53,30 @@ class TestGetHasherFactory(object):
             assert hasattr(hasher, 'update')
             assert hasattr(hasher, 'hexdigest')
 
+    def test_get_blake3(self):
+        blake3 = pytest.importorskip('blake3')
+        assert 'blake3' in algorithms_available
+        hasher_factory = _get_hasher_factory('blake3')
+        assert (
+            hasher_factory(b'abc').hexdigest() ==
+            blake3.blake3(b'abc').hexdigest()
+        )
+
+    def test_warn_once_if_sha_ni_missing(self, monkeypatch):
+        monkeypatch.setitem(
+            dirhash_module.cpu_features, 'sha-ni-available', False)
+        monkeypatch.setattr(dirhash_module, '_sha_ni_warning_issued', False)
+        monkeypatch.setattr(dirhash_module, '_hasher_factories', {})
+        with pytest.warns(UserWarning, match='SHA-NI') as record:
+            _get_hasher_factory('sha256')
+        # the warning points at the caller
+        assert record[0].filename == __file__
+        with warnings.catch_warnings(record=True) as record:
+            warnings.simplefilter('always')
+            _get_hasher_factory('sha1')
+            _get_hasher_factory('md5')
+        assert len(record) == 0
+
     def test_not_available(self):
         with pytest.raises(ValueError):
             _get_hasher_factory('not available')
@@ -76,6 +107,20 @@ class TestGetHasherFactory(object):
 
         hasher_factory = _get_hasher_factory(MockHasher)
         assert hasher_factory is MockHasher
+        assert MockHasher._dirhash_verified
+
+        # verification of base class does not apply to subclass
+        class BrokenMockHasher(MockHasher):
+
+            def update(self, *args, **kwargs):
+                raise NotImplementedError()
+
+        with pytest.raises(ValueError):
+            _get_hasher_factory(BrokenMockHasher)
+
+    def test_named_hasher_factory_cached(self):
+        for algorithm in algorithms_available:
+            assert _get_hasher_factory(algorithm) is _get_hasher_factory(algorithm)
 
 
 class TestGetMatchPatterns(object):
@@ -423,10 +468,37 @@ class TestGetIncludedPaths(TempDirTest):
         assert filepaths == ['.d2/.', 'd1/.']
 
 
+class TestFilter(object):
+
+    @pytest.mark.parametrize(
+        'match_patterns',
+        [
+            ['*'],
+            [],
+            ['*.py'],
+            ['*', '!.*'],
+            ['*', '!.*/', '!.*'],
+            ['*', '!*.ext', '*.ext'],
+            ['d1/*', 'd2/**/f', '!d2/d21/'],
+            ['/f', '!**/d11', 'd1/d11/f.ext', '# comment', ''],
+        ]
+    )
+    def test_match_file_same_as_recursion_filter(self, match_patterns):
+        filepaths = [
+            'f', 'f.py', 'f.ext', '.f', 'd1/f', 'd1/.f', 'd1/f.py', 'd1/d11/f',
+            'd1/d11/f.ext', '.d1/f', 'd2/f', 'd2/d21/f', 'd2/d21/d211/f.py',
+        ]
+        filter_ = Filter(match_patterns=match_patterns)
+        reference = RecursionFilter(match=match_patterns)
+        for filepath in filepaths:
+            assert filter_.match_file(filepath) == reference.match_file(filepath)
+
+
 def dirhash_mp_comp(*args, **kwargs):
     res = dirhash(*args, **kwargs)
-    res_mp = dirhash(jobs=2, *args, **kwargs)
-    assert res == res_mp
+    res_mt = dirhash(jobs=2, *args, **kwargs)
+    res_mp = dirhash(jobs=2, jobs_backend='process', *args, **kwargs)
+    assert res == res_mt == res_mp
     return res
 
 
@@ -484,6 +556,40 @@ class TestDirhash(TempDirTest):
         )
         assert empty_dirs_true == empty_dirs_true_expected
 
+        # initial hasher is copied for each directory if `copy` is supported
+        assert dirhash(
+            self.path_to('root'),
+            algorithm=CopyableIdentityHasher
+        ) == empty_dirs_false_expected
+
+    @pytest.mark.parametrize(
+        'entry_properties',
+        [
+            ['name', 'data'],
+            ['name'],
+            ['data'],
+            ['name', 'data', 'is_link'],
+            ['name', 'is_link'],
+            ['data', 'is_link'],
+        ]
+    )
+    def test_entry_descriptor_properties_sorted(self, entry_properties):
+        self.mkdirs('root')
+        self.mkfile('root/f1', 'a')
+        self.mkfile('root/f2', 'b')
+
+        descriptor = dirhash(
+            self.path_to('root'),
+            algorithm=IdentityHasher,
+            entry_properties=entry_properties
+        )
+        entry_descriptors = descriptor.split('\000\000')
+        assert len(entry_descriptors) == 2
+        for entry_descriptor in entry_descriptors:
+            entry_strings = entry_descriptor.split('\000')
+            assert len(entry_strings) == len(entry_properties)
+            assert entry_strings == sorted(entry_strings)
+
     def test_symlinked_file(self):
         self.mkdirs('root1')
         self.mkfile('root1/f1', 'a')
@@ -708,6 +814,29 @@ class TestDirhash(TempDirTest):
         assert elapsed_muliproc < expected_min_elapsed
         # just check "any speedup", the overhead varies (and is high on Travis)
 
+    def test_no_file_hashing_without_data_property(self):
+        self.mkdirs('root')
+        num_files = 10
+        for i in range(num_files):
+            self.mkfile('root/file_{}'.format(i), '< one chunk content')
+
+        expected_max_elapsed = SlowHasher.wait_time * num_files
+        for entry_properties, jobs in [
+            (['name'], 1),
+            (['name', 'is_link'], 1),
+            (['name'], num_files),
+        ]:
+            start = time()
+            dirhash(
+                self.path_to('root'),
+                algorithm=SlowHasher,
+                entry_properties=entry_properties,
+                jobs=jobs
+            )
+            end = time()
+            # only the directory descriptor is hashed
+            assert end - start < expected_max_elapsed
+
     def test_cache_by_real_path_speedup(self, tmpdir):
         num_links = 10
 
@@ -783,6 +912,21 @@ class TestDirhash(TempDirTest):
         elapsed_mp_cache = end - start
         assert elapsed_mp_cache < expected_max_elapsed
 
+    def test_hard_links_hashed_once(self, tmpdir):
+        num_links = 10
+        root = tmpdir.join('root')
+        root.ensure(dir=True)
+        target_file = root.join('file')
+        target_file.write('< one chunk content')
+        for i in range(num_links):
+            os.link(str(target_file), str(root.join('link_{}'.format(i))))
+
+        start = time()
+        dirhash(root, algorithm=SlowHasher, jobs=2)
+        end = time()
+        assert end - start < SlowHasher.wait_time * num_links / 2
+        dirhash_mp_comp(str(root), algorithm='md5')
+
     def test_hash_cyclic_link_to_root(self):
         self.mkdirs('root/d1')
         self.symlink('root', 'root/d1/link_back')
@@ -811,6 +955,45 @@ class TestDirhash(TempDirTest):
         self.mkfile('root/f1', '')
         dirhash_impl(self.path_to('root'), 'sha256', protocol=Protocol())
 
+    def test_multiproc_speedup_process_backend(self):
+        self.mkdirs('root')
+        num_files = 10
+        for i in range(num_files):
+            self.mkfile('root/file_{}'.format(i), '< one chunk content')
+
+        expected_min_elapsed = SlowHasher.wait_time * num_files
+        start = time()
+        dirhash(
+            self.path_to('root'),
+            algorithm=SlowHasher,
+            jobs=num_files,
+            jobs_backend='process'
+        )
+        end = time()
+        assert end - start < expected_min_elapsed
+
+    def test_process_backend_available_algorithm(self):
+        # `partial(hashlib.new, algorithm)` is not picklable in all python versions
+        self.mkdirs('root')
+        self.mkfile('root/f1', 'a')
+        for algorithm in sorted(algorithms_available - algorithms_guaranteed)[:3]:
+            assert dirhash(
+                self.path_to('root'), algorithm, jobs=2, jobs_backend='process'
+            ) == dirhash(self.path_to('root'), algorithm)
+
+    def test_raise_on_invalid_jobs_backend(self):
+        self.mkdirs('root')
+        self.mkfile('root/f1', '')
+        with pytest.raises(ValueError):
+            dirhash(self.path_to('root'), 'sha256', jobs=2, jobs_backend='fibers')
+
+    def test_raise_on_invalid_jobs(self):
+        self.mkdirs('root')
+        self.mkfile('root/f1', '')
+        for jobs in [0, -1]:
+            with pytest.raises(ValueError):
+                dirhash(self.path_to('root'), 'sha256', jobs=jobs)
+
     def test_raise_on_wrong_type(self):
         self.mkdirs('root')
         self.mkfile('root/f1', '')
@@ -846,11 +1029,103 @@ class IdentityHasher(object):
         return ''.join(self.datas)
 
 
+class CopyableIdentityHasher(IdentityHasher):
+
+    def copy(self):
+        hasher = CopyableIdentityHasher()
+        hasher.datas = list(self.datas)
+        return hasher
+
+
+class TestGetFilehash(object):
+
+    @pytest.mark.parametrize(
+        'size',
+        [
+            0, 10, 2**10 + 1,
+            _AF_ALG_THRESHOLD - 1, _AF_ALG_THRESHOLD, _AF_ALG_THRESHOLD + 1
+        ]
+    )
+    def test_same_hash_regardless_of_read_method(self, size, tmpdir):
+        data = os.urandom(size)
+        filepath = tmpdir.join('file')
+        filepath.write(data, mode='wb')
+        expected_hash = hashlib.sha256(data).digest()
+        for chunk_size in [2**4, 2**10, 2**20]:
+            filehash = _get_filehash(
+                str(filepath), hashlib.sha256, chunk_size=chunk_size
+            )
+            assert filehash == expected_hash
+
+    def test_hexdigest_only_hasher(self, tmpdir):
+        filepath = tmpdir.join('file')
+        filepath.write('content')
+        filehash = _get_filehash(str(filepath), IdentityHasher, chunk_size=2**10)
+        assert filehash == 'content'
+
+    def test_fadvise(self, tmpdir, monkeypatch):
+        if not hasattr(os, 'posix_fadvise'):
+            pytest.skip('posix_fadvise not supported')
+        advices = []
+
+        def posix_fadvise(fd, offset, length, advice):
+            advices.append(advice)
+
+        monkeypatch.setattr(os, 'posix_fadvise', posix_fadvise)
+        monkeypatch.setattr(dirhash_module, '_FADV_DONTNEED_THRESHOLD', 2**12)
+        for size, expected_advices in [
+            (2**4, []),
+            (2**11, [os.POSIX_FADV_SEQUENTIAL]),
+            (2**12, [os.POSIX_FADV_SEQUENTIAL, os.POSIX_FADV_DONTNEED]),
+        ]:
+            del advices[:]
+            data = os.urandom(size)
+            filepath = tmpdir.join('file_{}'.format(size))
+            filepath.write(data, mode='wb')
+            filehash = _get_filehash(str(filepath), hashlib.md5, chunk_size=2**10)
+            assert filehash == hashlib.md5(data).digest()
+            assert advices == expected_advices
+
+    @pytest.mark.parametrize(
+        'algorithm, hasher_factory, digest_size',
+        [
+            ('md5', hashlib.md5, 16),
+            ('sha1', hashlib.sha1, 20),
+            ('sha256', hashlib.sha256, 32),
+            ('sha512', hashlib.sha512, 64),
+        ]
+    )
+    def test_af_alg(self, algorithm, hasher_factory, digest_size, tmpdir):
+        try:
+            socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET).close()
+        except (AttributeError, EnvironmentError):
+            pytest.skip('AF_ALG sockets not supported')
+        data = os.urandom(_AF_ALG_THRESHOLD + 1)
+        filepath = tmpdir.join('file')
+        filepath.write(data, mode='wb')
+        with open(str(filepath), 'rb') as f:
+            filehash = _get_filehash_af_alg(f, len(data), algorithm, digest_size)
+        assert filehash == hasher_factory(data).digest()
+
+
+class TestPartitionBySize(object):
+
+    def test_balanced_bins(self):
+        sizes = {'a': 2**17, 'b': 2**15, 'c': 2**15, 'd': 2**14, 'e': 2**14}
+        bins = _partition_by_size(sizes, num_bins=2)
+        assert sorted(sorted(bin_) for bin_ in bins) == [['a'], ['b', 'c', 'd', 'e']]
+
+    def test_no_empty_bins(self):
+        assert _partition_by_size({'a': 1}, num_bins=4) == [['a']]
+
+
 class TestProtocol(object):
 
     def test_raise_for_invalid_entry_properties(self):
         with pytest.raises(ValueError):
             Protocol(entry_properties=['not-valid'])
+        with pytest.raises(ValueError):
+            Protocol(entry_properties=['is_link'])
 
     def test_raise_for_invalid_allow_cyclic_links(self):
         with pytest.raises(ValueError):
@@ -861,7 +1136,16 @@ def mock_func(x):
     return x * 2
 
 
+@pytest.mark.parametrize('backend', ['thread', 'process'])
 @pytest.mark.parametrize('jobs', [1, 2, 4])
-def test_parmap(jobs):
+def test_parmap(jobs, backend):
     inputs = [1, 2, 3, 4]
-    assert _parmap(mock_func, inputs, jobs=jobs) == [2, 4, 6, 8]
+    assert _parmap(mock_func, inputs, jobs=jobs, backend=backend) == [2, 4, 6, 8]
+
+
+@pytest.mark.parametrize('chunksize', [None, 1, 3, 10])
+def test_parmap_chunksize_preserves_order(chunksize):
+    inputs = list(range(10))
+    assert _parmap(
+        mock_func, inputs, jobs=2, chunksize=chunksize
+    ) == [2 * x for x in inputs]